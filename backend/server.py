@@ -1,21 +1,44 @@
-from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, Form, Response
+from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException, Form
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-import pymongo
+from pymongo import InsertOne, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
 from dataclasses import dataclass
 import uuid
+import hashlib
+import mmap
+import zlib
 from datetime import datetime, timezone
 import shutil
 import httpx
+import orjson
 import asyncio
+import random
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import re
-from PyPDF2 import PdfReader
+from itertools import groupby, islice, repeat
+from functools import lru_cache
+import aiofiles
+from cachetools import TTLCache
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    # Fall back to the much slower pure-Python PyPDF2 extractor
+    pdfium = None
+    from PyPDF2 import PdfReader
 
 # Custom classes for message handling
 @dataclass
@@ -32,18 +55,22 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 logging.basicConfig(level=logging.INFO)
-logging.info(f"GEMINI_API_KEY loaded: {'set' if os.environ.get('GEMINI_API_KEY') else 'NOT set'}")
-if not os.environ.get('GEMINI_API_KEY'):
-    logging.error("GEMINI_API_KEY is not set. Document analysis will not work!")
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'legal_docs')
+# Connections kept by the shared MongoDB client, sized for concurrent request load
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+logging.info(f"GEMINI_API_KEY loaded: {'set' if GEMINI_API_KEY else 'NOT set'}")
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # MongoDB connection
 try:
-    mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-    client = AsyncIOMotorClient(mongo_url)
-    db = client[os.environ.get('DB_NAME', 'legal_docs')]
+    client = AsyncIOMotorClient(MONGO_URL, tz_aware=True, maxPoolSize=MONGO_MAX_POOL_SIZE)
+    db = client[DB_NAME]
+    # Fire-and-forget handle for non-critical status transitions
+    unacked_documents = db.documents.with_options(write_concern=WriteConcern(w=0))
     # Test the connection
     client.admin.command('ping')
     logging.info("Successfully connected to MongoDB")
@@ -66,6 +93,27 @@ api_router = APIRouter(prefix="/api")
 # Create uploads directory
 UPLOAD_DIR = ROOT_DIR / "../uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Analysis prompt, with a {document_text} placeholder for the document content
+ANALYSIS_PROMPT_TEMPLATE = (ROOT_DIR / "prompts" / "analysis.txt").read_text(encoding="utf-8").rstrip("\n")
+
+# Amount of document text sent to the model for analysis
+ANALYSIS_MAX_TOKENS = 12_000
+# PDF extraction stops after this many characters, comfortably above the token budget
+ANALYSIS_MAX_CHARS = ANALYSIS_MAX_TOKENS * 6
+
+# Amount of document text included in question prompts
+QA_MAX_CHARS = 100_000
+
+# Exported reports are streamed to the client in chunks of this size
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Cached extracted texts at least this long are stored zlib-compressed
+EXTRACTED_TEXT_COMPRESS_THRESHOLD = 16 * 1024
+
+# Maximum number of threads used for blocking document processing
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', '4'))
 
 # Pydantic Models
 class Document(BaseModel):
@@ -78,6 +126,21 @@ class Document(BaseModel):
     summary: Optional[str] = None
     key_clauses: Optional[List[dict]] = None
     risk_assessment: Optional[str] = None
+    content_hash: Optional[str] = None  # sha256 of the uploaded bytes
+    analysis_model: Optional[str] = None
+    extraction_mode: Optional[str] = None  # text, ocr; set for PDFs when analysed
+    text_length: Optional[int] = None
+
+class DocumentSummary(BaseModel):
+    id: str
+    filename: str
+    file_type: str
+    upload_date: datetime
+    analysis_status: str
+
+DOCUMENT_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in DocumentSummary.model_fields}}
+# Skips internal fields such as the cached extracted text
+DOCUMENT_PROJECTION = {"_id": 0, **{field: 1 for field in Document.model_fields}}
 
 class DocumentCreate(BaseModel):
     filename: str
@@ -96,9 +159,134 @@ class ChatMessage(BaseModel):
     answer: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+CHAT_MESSAGE_PROJECTION = {"_id": 0, **{field: 1 for field in ChatMessage.model_fields}}
+
 class AnalysisRequest(BaseModel):
     document_id: str
 
+# Fields needed to run (or return) a document analysis
+ANALYSIS_PROJECTION = {
+    "_id": 0,
+    "file_path": 1,
+    "file_type": 1,
+    "content_hash": 1,
+    "analysis_status": 1,
+    "summary": 1,
+    "key_clauses": 1,
+    "risk_assessment": 1
+}
+
+# Fields needed to answer a question about a document
+QA_PROJECTION = {
+    "_id": 0,
+    "file_path": 1,
+    "file_type": 1,
+    "content_hash": 1,
+    "extracted_text": 1,
+    "extracted_sha": 1,
+    "extraction_mode": 1
+}
+
+# Fields rendered into exported reports
+EXPORT_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "filename": 1,
+    "analysis_status": 1,
+    "summary": 1,
+    "key_clauses": 1,
+    "risk_assessment": 1,
+    "recommendations": 1,
+    "plain_english_explanation": 1
+}
+
+# Batches writes from concurrent requests into bulk_write calls
+class MongoWriteBatcher:
+    """Queue write operations and flush them to a collection in bulk"""
+
+    def __init__(self, collection, max_batch: int = 500, max_delay: float = 0.05):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush pending writes and stop the background task"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def submit(self, operation):
+        """Queue a write operation and wait until its batch has been written"""
+        if self._task is None:
+            await self.collection.bulk_write([operation], ordered=False)
+            return
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        try:
+            await self.collection.bulk_write([operation for operation, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # Unordered writes still apply the other operations, so only fail the ones
+            # that errored. A write concern error leaves every operation unconfirmed.
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            write_concern_failed = bool(e.details.get("writeConcernErrors"))
+            logging.error(f"Bulk write had {len(write_errors)} of {len(batch)} operations fail: {str(e)}")
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if write_concern_failed:
+                    future.set_exception(e)
+                elif index in write_errors:
+                    future.set_exception(BulkWriteError({**e.details, "writeErrors": [write_errors[index]]}))
+                else:
+                    future.set_result(None)
+        except Exception as e:
+            logging.error(f"Bulk write of {len(batch)} operations failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+document_writer = MongoWriteBatcher(db.documents)
+chat_writer = MongoWriteBatcher(db.chat_messages)
+
 # OCR helper function for PDFs
 def extract_text_with_ocr(pdf_path: str) -> str:
     """Extract text from PDF using OCR when regular extraction fails"""
@@ -108,7 +296,209 @@ def extract_text_with_ocr(pdf_path: str) -> str:
     except Exception as e:
         return f"OCR processing failed: {str(e)}"
 
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+# PDFium is not thread-safe, so all calls into it are serialised
+PDFIUM_LOCK = threading.Lock()
+
+# Threads for blocking PDF text extraction, created on startup
+extraction_executor: Optional[ThreadPoolExecutor] = None
+
+# Process pool for the PyPDF2 fallback, created on startup when PDFium is unavailable
+pdf_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _extract_pypdf2_page(path: str, page_index: int) -> str:
+    """Extract the text of a single page with PyPDF2 (runs in a worker process)"""
+    return PdfReader(path).pages[page_index].extract_text()
+
+def _iter_pdf_page_texts(path: str):
+    """Yield the text of each PDF page, using PDFium when it is installed"""
+    if pdfium is None:
+        reader = PdfReader(path)
+        page_count = len(reader.pages)
+        if pdf_process_pool is None or page_count <= 4:
+            for page in reader.pages:
+                yield page.extract_text()
+            return
+        # PyPDF2 is pure Python, so spread pages over processes. Work one pool-sized
+        # window at a time so an early cutoff doesn't extract the remaining pages.
+        for window_start in range(0, page_count, EXTRACTION_WORKERS):
+            page_indexes = range(window_start, min(window_start + EXTRACTION_WORKERS, page_count))
+            yield from pdf_process_pool.map(_extract_pypdf2_page, repeat(path), page_indexes)
+        return
+
+    # Held until the generator finishes or is closed, so the document is never
+    # touched from two threads at once
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                try:
+                    yield textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+def _extract_pdf_text(path: str, max_chars: Optional[int] = None) -> str:
+    """Extract the text of non-empty PDF pages (blocking, run in a worker thread)
+
+    Stops reading further pages once max_chars characters have been collected.
+    """
+    text_pages = []
+    text_length = 0
+    page_texts = _iter_pdf_page_texts(path)
+    try:
+        for page_text in page_texts:
+            if page_text and page_text.strip():
+                text_pages.append(page_text)
+                text_length += len(page_text) + 1
+                if max_chars is not None and text_length >= max_chars:
+                    break
+    finally:
+        page_texts.close()
+    return "\n".join(text_pages)
+
+async def _extract_pdf_text_or_ocr(path: str, max_chars: Optional[int] = None,
+                                   extraction_mode: Optional[str] = None):
+    """Extract PDF text with OCR running alongside as the fallback for image-based PDFs
+
+    Returns (text, ocr_text); ocr_text is None when the extracted text is long enough
+    and the OCR job has been cancelled. A known extraction_mode from an earlier
+    analysis ('text' or 'ocr') runs only that path.
+    """
+    if extraction_mode == 'text':
+        text = await asyncio.get_running_loop().run_in_executor(extraction_executor, _extract_pdf_text, path, max_chars)
+        return text, None
+    if extraction_mode == 'ocr':
+        return "", await asyncio.to_thread(extract_text_with_ocr, path)
+
+    loop = asyncio.get_running_loop()
+    ocr_future = loop.run_in_executor(None, extract_text_with_ocr, path)
+    try:
+        text = await loop.run_in_executor(extraction_executor, _extract_pdf_text, path, max_chars)
+    except BaseException:
+        ocr_future.cancel()
+        raise
+    if len(text.strip()) >= 50:
+        ocr_future.cancel()
+        return text, None
+    return text, await ocr_future
+
+# Tokenizer used to size prompts, set only once it has loaded successfully
+token_encoding = None
+_token_encoding_loader: Optional[threading.Thread] = None
+_token_encoding_lock = threading.Lock()
+
+def _load_token_encoding():
+    """Load the tokenizer, which may download its BPE file with no timeout (blocking)"""
+    global token_encoding
+    try:
+        token_encoding = tiktoken.get_encoding("cl100k_base")
+        logging.info("Tokenizer loaded")
+    except Exception as e:
+        logging.warning(f"Tokenizer unavailable, truncating prompts by characters: {str(e)}")
+
+def _start_token_encoding_load():
+    """Load the tokenizer on a daemon thread unless it is loaded or already loading"""
+    global _token_encoding_loader
+    if tiktoken is None or token_encoding is not None:
+        return
+    with _token_encoding_lock:
+        if _token_encoding_loader is not None and _token_encoding_loader.is_alive():
+            return
+        _token_encoding_loader = threading.Thread(target=_load_token_encoding, name="tokenizer-load", daemon=True)
+        _token_encoding_loader.start()
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to at most max_tokens tokens, cutting on a token boundary (blocking)"""
+    encoding = token_encoding
+    if encoding is None:
+        # Not loaded (yet): retry the load in the background and meanwhile use
+        # roughly four characters per token for English text
+        _start_token_encoding_load()
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def _file_sha256(path: str) -> str:
+    """sha256 of a file's bytes, read through mmap (blocking)"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+def _pack_extracted_text(text: str) -> Union[str, bytes]:
+    """Compress large extracted texts before storing them on the document"""
+    if len(text) >= EXTRACTED_TEXT_COMPRESS_THRESHOLD:
+        return zlib.compress(text.encode('utf-8'), 1)
+    return text
+
+def _unpack_extracted_text(value: Union[str, bytes]) -> str:
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+# Patterns used to parse the AI analysis response, compiled once at import.
+# Headings may be markdown, bold and/or numbered ("1.", "III.").
+_RE_SECTION_HEADING = re.compile(
+    r"^[ \t#*]*(?:(?:\d+|[IVX]+)[.)][ \t#*]*)?"
+    r"(EXECUTIVE SUMMARY|KEY CLAUSES|RISK ASSESSMENT|PLAIN ENGLISH EXPLANATION)(?: ANALYSIS)?[ \t#*:]*$",
+    re.MULTILINE
+)
+_RE_CLAUSE_ITEM = re.compile(r"(\d+)\.\s*(.*?)(?=\n\d+\.|$)", re.DOTALL)
+_RE_CLAUSE_ITEM_MD = re.compile(r"-\s*\*\*Clause Name\*\*:\s*\*(.*?)\*\s*\n\s*(.*?)(?=-\s*\*\*Clause Name\*\*|$)", re.DOTALL)
+_CLAUSE_FIELD_PATTERNS = {
+    "reference": re.compile(r"Exact Clause Reference:\s*(.*?)(?=\n\s*Plain English Explanation:|$)", re.DOTALL),
+    "explanation": re.compile(r"Plain English Explanation:\s*(.*?)(?=\n\s*Legal Implications:|$)", re.DOTALL),
+    "implications": re.compile(r"Legal Implications:\s*(.*?)(?=\n\s*Business Impact:|$)", re.DOTALL),
+    "impact": re.compile(r"Business Impact:\s*(.*?)(?=\n\s*Potential Concerns:|$)", re.DOTALL),
+    "concerns": re.compile(r"Potential Concerns:\s*(.*?)(?=\n\d+\.|$)", re.DOTALL)
+}
+_RE_BLANK_LINES = re.compile(r'\n\s*\n\s*\n')
+MAX_KEY_CLAUSES = 7
+
+def _split_analysis_sections(text: str) -> dict:
+    """Map each section heading to its body, scanning the response once
+
+    A section runs until the next recognised heading; only the first
+    occurrence of each heading is kept.
+    """
+    headings = list(_RE_SECTION_HEADING.finditer(text))
+    sections = {}
+    for i, match in enumerate(headings):
+        name = match.group(1)
+        if name in sections:
+            continue
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        sections[name] = text[match.end():end].strip()
+    return sections
+
+# Markdown and bullet artifacts stripped from AI text before export. Every
+# artifact token (**, ```, ### ...) is made of these characters, so a single
+# translate pass drops them all.
+_AI_ARTIFACT_TABLE = str.maketrans('', '', '*`#•·▪◦')
+# Applied in this order, matching the original replacements
+_RE_UNDERSCORE_ITALIC = re.compile(r'_(.*?)_')
+_RE_UNDERSCORE_BOLD = re.compile(r'__(.*?)__')
+_RE_WHITESPACE = re.compile(r'\s+')
+
+def clean_ai_response(text):
+    """Clean the AI response content to remove artifacts"""
+    if not text:
+        return ''
+    # Remove various AI artifacts and formatting
+    text = text.translate(_AI_ARTIFACT_TABLE)
+    # Remove markdown-style bold and italic
+    text = _RE_UNDERSCORE_ITALIC.sub(r'\1', text)
+    text = _RE_UNDERSCORE_BOLD.sub(r'\1', text)
+    # Collapse all whitespace, including blank lines, to single spaces
+    text = _RE_WHITESPACE.sub(' ', text)
+    return text.strip()
+
 if not GEMINI_API_KEY:
     logging.error("GEMINI_API_KEY environment variable is not set!")
     raise ValueError("GEMINI_API_KEY environment variable is required")
@@ -117,18 +507,46 @@ if not GEMINI_API_KEY:
 if not GEMINI_API_KEY.startswith('AIza'):
     logging.warning("GEMINI_API_KEY does not appear to be a valid Google AI API key format")
 
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
 
-async def send_message(prompt: str) -> str:
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=503, detail="AI service is not configured. Please set GEMINI_API_KEY environment variable.")
+# Shared HTTP client for Gemini requests, created on startup so connections are reused
+http_client: Optional[httpx.AsyncClient] = None
+
+# Limits concurrent Gemini calls to stay within the API quota
+GEMINI_SEMAPHORE = asyncio.Semaphore(int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8')))
+
+# Analyses currently running, keyed by document id
+INFLIGHT_ANALYSES: Dict[str, asyncio.Task] = {}
+
+# Recent answers, keyed by a hash of the document id and normalised question
+QA_ANSWER_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
 
+# Longest Retry-After honoured while a client request is waiting on the answer
+RETRY_AFTER_MAX_SECONDS = 30.0
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After
+
+    Retry-After is capped at RETRY_AFTER_MAX_SECONDS so a large value can't hold
+    the request open for minutes.
+    """
+    try:
+        minimum = min(float(retry_after), RETRY_AFTER_MAX_SECONDS) if retry_after else 0.0
+    except ValueError:
+        # Retry-After may also be an HTTP date; fall back to plain backoff
+        minimum = 0.0
+    return max(minimum, random.uniform(0, 2 ** attempt))
+
+async def send_message(prompt: str) -> str:
+    # GEMINI_API_KEY is checked once at import, startup fails without it
     max_retries = 3
 
     for attempt in range(max_retries):
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
+            # Cap the number of Gemini calls in flight across all requests
+            async with GEMINI_SEMAPHORE:
+                response = await http_client.post(
                     GEMINI_API_URL,
                     json={
                         "contents": [
@@ -146,47 +564,62 @@ async def send_message(prompt: str) -> str:
                     }
                 )
 
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'candidates' in data and len(data['candidates']) > 0:
-                        candidate = data['candidates'][0]
-                        if 'content' in candidate and 'parts' in candidate['content'] and len(candidate['content']['parts']) > 0:
-                            return candidate['content']['parts'][0]['text']
-                        else:
-                            raise Exception("Invalid response structure from Gemini API")
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                if 'candidates' in data and len(data['candidates']) > 0:
+                    candidate = data['candidates'][0]
+                    if 'content' in candidate and 'parts' in candidate['content'] and len(candidate['content']['parts']) > 0:
+                        return candidate['content']['parts'][0]['text']
                     else:
-                        raise Exception("No candidates in Gemini API response")
-                elif response.status_code in (429, 500, 502, 503, 504):
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        logging.warning(f"Gemini API retryable error (attempt {attempt + 1}/{max_retries}): {response.status_code} - {response.text}")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        logging.error(f"Gemini API failed after {max_retries} attempts: {response.status_code} - {response.text}")
-                        raise HTTPException(status_code=503, detail=f"AI service is temporarily unavailable. Please try again later.")
+                        raise Exception("Invalid response structure from Gemini API")
+                else:
+                    raise Exception("No candidates in Gemini API response")
+            elif response.status_code in (429, 500, 502, 503, 504):
+                if attempt < max_retries - 1:
+                    wait_time = _retry_delay(attempt, response.headers.get("Retry-After"))
+                    logging.warning("Gemini API retryable error (attempt %d/%d): %s", attempt + 1, max_retries, response.status_code)
+                    await asyncio.sleep(wait_time)
+                    continue
                 else:
-                    logging.error(f"Gemini API non-retryable error: {response.status_code} - {response.text}")
-                    raise HTTPException(status_code=500, detail=f"AI service error: {response.text}")
+                    logging.error("Gemini API failed after %d attempts: %s - %s", max_retries, response.status_code, response.text)
+                    raise HTTPException(status_code=503, detail=f"AI service is temporarily unavailable. Please try again later.")
+            else:
+                logging.error("Gemini API non-retryable error: %s - %s", response.status_code, response.text)
+                raise HTTPException(status_code=500, detail=f"AI service error: {response.text}")
+
+        except HTTPException:
+            # Our own errors are final, don't retry them
+            raise
 
         except httpx.TimeoutException:
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logging.warning(f"Gemini API timeout (attempt {attempt + 1}/{max_retries})")
+                wait_time = _retry_delay(attempt)
+                logging.warning("Gemini API timeout (attempt %d/%d)", attempt + 1, max_retries)
                 await asyncio.sleep(wait_time)
                 continue
             else:
-                logging.error(f"Gemini API timeout after {max_retries} attempts")
+                logging.error("Gemini API timeout after %d attempts", max_retries)
                 raise HTTPException(status_code=504, detail="AI service request timed out. Please try again later.")
 
+        except httpx.TransportError as e:
+            # Connection-level failures (connect/read errors) are transient
+            if attempt < max_retries - 1:
+                wait_time = _retry_delay(attempt)
+                logging.warning("Gemini API connection error (attempt %d/%d): %s", attempt + 1, max_retries, e)
+                await asyncio.sleep(wait_time)
+                continue
+            else:
+                logging.error("Gemini API connection failed after %d attempts: %s", max_retries, e)
+                raise HTTPException(status_code=503, detail="AI service is temporarily unavailable. Please try again later.")
+
         except Exception as e:
             if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logging.warning(f"Gemini API error (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                wait_time = _retry_delay(attempt)
+                logging.warning("Gemini API error (attempt %d/%d): %s", attempt + 1, max_retries, e)
                 await asyncio.sleep(wait_time)
                 continue
             else:
-                logging.error(f"Gemini API failed after {max_retries} attempts: {str(e)}")
+                logging.error("Gemini API failed after %d attempts: %s", max_retries, e)
                 raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
     # This should never be reached, but just in case
@@ -214,43 +647,42 @@ async def upload_document(file: UploadFile = File(...)):
         unique_filename = f"{file_id}{file_extension}"
         file_path = UPLOAD_DIR / unique_filename
         
-        # Read file content fully before writing
-        contents = await file.read()
-        
-        # Save file
+        # Save file, streaming it to disk in chunks instead of buffering it in memory
+        partial_path = file_path.with_suffix(file_path.suffix + ".part")
+        hasher = hashlib.sha256()
         try:
             logging.info(f"Attempting to save file to: {file_path}")
-            with open(file_path, "wb") as buffer:
-                buffer.write(contents)
+            async with aiofiles.open(partial_path, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    await out.write(chunk)
+            os.replace(partial_path, file_path)
             logging.info("File saved successfully")
 
             # Create document record
             document = Document(
                 filename=file.filename,
                 file_path=str(file_path),
-                file_type=file.content_type
+                file_type=file.content_type,
+                content_hash=hasher.hexdigest()
             )
             
-            # Save to database (using synchronous approach to avoid event loop conflicts)
+            # Save to database
+            # upload_date is stored as a native BSON date
             document_dict = document.model_dump()
-            document_dict['upload_date'] = document_dict['upload_date'].isoformat()
-
-            # Use synchronous MongoDB client for this operation
-            import pymongo
-            sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-            sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-            sync_db.documents.insert_one(document_dict)
-            sync_client.close()
+
+            await db.documents.insert_one(document_dict)
             
             return {"document_id": document.id, "filename": document.filename, "status": "uploaded"}
             
         except Exception as e:
             logging.error(f"Error saving file: {str(e)}")
-            if file_path.exists():
-                try:
-                    file_path.unlink()
-                except:
-                    pass
+            for path in (partial_path, file_path):
+                if path.exists():
+                    try:
+                        path.unlink()
+                    except:
+                        pass
             raise
         
     except HTTPException:
@@ -260,20 +692,13 @@ async def upload_document(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="File upload failed")
 
 # Get all documents
-@api_router.get("/documents", response_model=List[Document])
+@api_router.get("/documents", response_model=List[DocumentSummary])
 async def get_documents():
     """Get all uploaded documents"""
     try:
-        # Use synchronous MongoDB client to avoid event loop conflicts
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        documents = list(sync_db.documents.find())
-        sync_client.close()
-
-        for doc in documents:
-            if isinstance(doc.get('upload_date'), str):
-                doc['upload_date'] = datetime.fromisoformat(doc['upload_date'])
-        return [Document(**doc) for doc in documents]
+        # Only load the listing fields, not the (potentially large) analysis results
+        documents = await db.documents.find({}, DOCUMENT_SUMMARY_PROJECTION).to_list(length=None)
+        return documents
     except Exception as e:
         logging.error(f"Get documents error: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve documents")
@@ -286,13 +711,8 @@ async def delete_document(document_id: str):
         # Log the delete request
         logging.info(f"Attempting to delete document with ID: {document_id}")
 
-        # Use synchronous MongoDB client to avoid event loop conflicts
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-
-        document = sync_db.documents.find_one({"id": document_id})
+        document = await db.documents.find_one({"id": document_id}, {"_id": 0, "file_path": 1})
         if not document:
-            sync_client.close()
             logging.warning(f"Document not found for deletion: {document_id}")
             raise HTTPException(status_code=404, detail="Document not found")
 
@@ -307,8 +727,7 @@ async def delete_document(document_id: str):
             # Continue with document deletion even if file deletion fails
 
         # Delete the document record from the database
-        result = sync_db.documents.delete_one({"id": document_id})
-        sync_client.close()
+        result = await db.documents.delete_one({"id": document_id})
 
         if result.deleted_count == 0:
             logging.warning(f"Document not deleted from database: {document_id}")
@@ -328,18 +747,11 @@ async def delete_document(document_id: str):
 async def get_document(document_id: str):
     """Get a specific document by ID"""
     try:
-        # Use synchronous MongoDB client to avoid event loop conflicts
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        document = sync_db.documents.find_one({"id": document_id})
-        sync_client.close()
+        document = await db.documents.find_one({"id": document_id}, DOCUMENT_PROJECTION)
 
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        if isinstance(document.get('upload_date'), str):
-            document['upload_date'] = datetime.fromisoformat(document['upload_date'])
-
         return Document(**document)
     except HTTPException:
         raise
@@ -351,18 +763,36 @@ async def get_document(document_id: str):
 @api_router.post("/documents/{document_id}/analyze")
 async def analyze_document(document_id: str):
     """Analyze a document using AI"""
+    # Concurrent requests for the same document share a single analysis
+    task = INFLIGHT_ANALYSES.get(document_id)
+    if task is None:
+        task = asyncio.ensure_future(_analyze_document(document_id))
+        INFLIGHT_ANALYSES[document_id] = task
+        task.add_done_callback(lambda _: INFLIGHT_ANALYSES.pop(document_id, None))
+    return await asyncio.shield(task)
+
+async def _analyze_document(document_id: str):
     try:
-        # Get document from database
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        document = sync_db.documents.find_one({"id": document_id})
+        # Flip the status to processing and fetch the document in a single round-trip,
+        # unless a completed analysis already exists
+        document = await db.documents.find_one_and_update(
+            {
+                "id": document_id,
+                "$or": [
+                    {"analysis_status": {"$ne": "completed"}},
+                    {"summary": {"$in": [None, ""]}}
+                ]
+            },
+            {"$set": {"analysis_status": "processing"}},
+            projection=ANALYSIS_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
         if not document:
-            sync_client.close()
-            raise HTTPException(status_code=404, detail="Document not found")
+            document = await db.documents.find_one({"id": document_id}, ANALYSIS_PROJECTION)
+            if not document:
+                raise HTTPException(status_code=404, detail="Document not found")
 
-        # Check if analysis already completed
-        if document.get('analysis_status') == 'completed' and document.get('summary'):
-            sync_client.close()
+            # Analysis already completed
             logging.info(f"Returning cached analysis for document {document_id}")
             return {
                 "document_id": document_id,
@@ -372,32 +802,48 @@ async def analyze_document(document_id: str):
                 "risk_assessment": document.get('risk_assessment', '')
             }
 
-        # Update status to processing
-        sync_db.documents.update_one(
-            {"id": document_id},
-            {"$set": {"analysis_status": "processing"}}
-        )
-        sync_client.close()
+        # Reuse the analysis of an identical upload made with the same model
+        if document.get('content_hash'):
+            cached = await db.documents.find_one(
+                {
+                    "content_hash": document['content_hash'],
+                    "analysis_model": GEMINI_MODEL,
+                    "analysis_status": "completed",
+                    "id": {"$ne": document_id}
+                },
+                {"_id": 0, "summary": 1, "key_clauses": 1, "risk_assessment": 1, "extraction_mode": 1, "text_length": 1}
+            )
+            if cached and cached.get('summary'):
+                logging.info(f"Reusing analysis of identical content for document {document_id}")
+                await document_writer.submit(UpdateOne(
+                    {"id": document_id},
+                    {"$set": {"analysis_status": "completed", "analysis_model": GEMINI_MODEL, **cached}}
+                ))
+                return {
+                    "document_id": document_id,
+                    "status": "completed",
+                    "summary": cached.get('summary', ''),
+                    "key_clauses": cached.get('key_clauses', []),
+                    "risk_assessment": cached.get('risk_assessment', '')
+                }
 
         # Read the document content
         document_text = ""
+        # How the PDF text was obtained, saved so questions can skip the OCR probe
+        extraction_info = {}
         try:
             if document['file_type'] == 'application/pdf' or document['file_path'].lower().endswith('.pdf'):
-                # Extract text from PDF using PyPDF2
+                # Extract text from PDF off the event loop, with OCR running alongside
                 try:
-                    reader = PdfReader(document['file_path'])
-                    text_pages = []
-                    for page in reader.pages:
-                        page_text = page.extract_text()
-                        if page_text and page_text.strip():
-                            text_pages.append(page_text)
-
-                    document_text = "\n".join(text_pages)
+                    document_text, ocr_text = await _extract_pdf_text_or_ocr(document['file_path'], ANALYSIS_MAX_CHARS)
+                    extraction_info = {
+                        "extraction_mode": "text" if ocr_text is None else "ocr",
+                        "text_length": len(document_text if ocr_text is None else ocr_text)
+                    }
 
-                    if len(document_text.strip()) < 50:
-                        # Try OCR as fallback for image-based PDFs
-                        logging.info("Attempting OCR processing for image-based PDF")
-                        ocr_text = extract_text_with_ocr(document['file_path'])
+                    if ocr_text is not None:
+                        # Fall back to OCR for image-based PDFs
+                        logging.info("Using OCR result for image-based PDF")
 
                         if len(ocr_text.strip()) > len(document_text.strip()):
                             document_text = ocr_text
@@ -414,7 +860,7 @@ async def analyze_document(document_id: str):
                     logging.error(f"PDF text extraction error for file {document['file_path']}: {str(e)}")
             else:
                 with open(document['file_path'], 'r', encoding='utf-8') as f:
-                    document_text = f.read()
+                    document_text = f.read(ANALYSIS_MAX_CHARS)
                 logging.info(f"Document content read successfully. Length: {len(document_text)} characters")
                 logging.info(f"First 500 characters: {document_text[:500]}")
 
@@ -452,71 +898,11 @@ async def analyze_document(document_id: str):
             analysis_prompt = """I need you to provide a legal document analysis, but the document content could not be properly extracted or is insufficient for detailed analysis. This may be due to file format limitations, reading errors, or the document being too short."""
         else:
             # If we have meaningful document content, analyze it specifically
-            analysis_prompt = f"""You are a senior legal document analysis expert with 4000+ years of experience reviewing contracts and legal agreements. Below is the content of a legal document that requires thorough professional analysis.
-
-DOCUMENT CONTENT TO ANALYZE:
-{document_text[:999999999]}
-
-CRITICAL REQUIREMENTS:
-- Base your ENTIRE analysis on the specific content provided above
-- Do NOT provide generic legal advice or templates
-- Reference specific text, terms, and clauses from THIS document
-- Be precise, professional, and actionable in your analysis
-
-ANALYSIS REQUEST:
-Provide a comprehensive structured analysis with these exact section headers:
-
-EXECUTIVE SUMMARY
-Provide a detailed executive summary that includes:
-- Document Type & Purpose: What kind of legal document this is and its primary objective
-- Key Parties Involved: Who are the main parties and their roles
-- Core Obligations: The fundamental commitments and responsibilities outlined
-- Critical Timeline: Any important dates, deadlines, or time-sensitive provisions
-- Financial Implications: Any monetary amounts, payment terms, or financial commitments mentioned
-- Overall Risk Level: High-level assessment of potential risks (Low/Medium/High)
-
-KEY CLAUSES ANALYSIS
-Identify and analyze the most critical clauses or provisions from THIS document's content. For each clause, provide:
-
-1. Exact Clause Reference: Quote the specific section/clause number or title from the document
-2. Plain English Explanation: What this clause means in simple, understandable terms
-3. Legal Implications: What rights, obligations, or restrictions it creates
-4. Business Impact: How this affects the parties' relationship or operations
-5. Potential Concerns: Any ambiguities, one-sided terms, or areas requiring attention
-
-Format each clause as a numbered item with clear subheadings.
-
-RISK ASSESSMENT
-Conduct a thorough risk analysis covering:
-
-HIGH-RISK ISSUES
-- Terms that could cause significant financial loss or legal liability
-- Unfavorable or one-sided provisions that disadvantage one party
-- Ambiguous language that could lead to disputes
-- Missing protections or standard clauses that should be present
-
-MEDIUM-RISK CONCERNS
-- Terms that could create operational difficulties
-- Provisions requiring ongoing compliance or monitoring
-- Clauses with conditional obligations that depend on external factors
-
-LOW-RISK ITEMS
-- Standard boilerplate provisions
-- Clearly defined, balanced terms
-- Protective clauses that benefit both parties
-
-FORMATTING REQUIREMENTS:
-- Use clear, professional formatting with proper spacing and structure
-- Use markdown formatting for better readability (bold, italics, lists, etc.)
-- Ensure consistent spacing between sections and subsections
-- Make the analysis comprehensive yet accessible to non-lawyers
-- Format lists and bullet points professionally
-- Use clear headings and subheadings for easy navigation
-- Do not use emojis or special characters in headings - use plain text only
-- Ensure every conclusion is directly supported by the document content
-- Provide well-phrased, clear explanations with good grammar and structure
-- Use proper line breaks and spacing between sections for readability
-- IMPORTANT: Do not include any RECOMMENDATIONS or PLAIN ENGLISH EXPLANATION sections in your response"""
+            # Cap by characters first so encoding never sees more than the budget needs
+            prompt_body = await asyncio.to_thread(
+                _truncate_to_tokens, document_text[:ANALYSIS_MAX_CHARS], ANALYSIS_MAX_TOKENS
+            )
+            analysis_prompt = ANALYSIS_PROMPT_TEMPLATE.format(document_text=prompt_body)
 
         try:
             logging.info("Starting AI analysis call")
@@ -528,131 +914,78 @@ FORMATTING REQUIREMENTS:
             if not analysis_text or len(analysis_text.strip()) < 100:
                 raise Exception("Analysis response too short or empty")
 
-            import re
-            # Parse sections using regex for more robust extraction
+            # Split the response into sections in a single pass over its headings
+            # (handles both markdown and plain heading formats)
+            sections = _split_analysis_sections(analysis_text)
 
-            # Extract executive summary - handle both emoji and plain formats
-            summary = ""
-            try:
-                # Try emoji format first (cached responses)
-                summary_match = re.search(r"## EXECUTIVE SUMMARY\s*\n(.*?)(?=\n## KEY CLAUSES|$)", analysis_text, re.DOTALL)
-                if not summary_match:
-                    # Try plain format (new responses)
-                    summary_match = re.search(r"EXECUTIVE SUMMARY\s*\n(.*?)(?=\nKEY CLAUSES ANALYSIS|$)", analysis_text, re.DOTALL)
-                if summary_match:
-                    summary = summary_match.group(1).strip()
-                else:
-                    logging.warning("EXECUTIVE SUMMARY section not found in analysis text")
-            except Exception as e:
-                logging.error(f"Error parsing executive summary section with regex: {str(e)}")
-                summary = ""
+            # Extract executive summary
+            summary = sections.get("EXECUTIVE SUMMARY", "")
+            if "EXECUTIVE SUMMARY" not in sections:
+                logging.warning("EXECUTIVE SUMMARY section not found in analysis text")
 
-            # Extract and parse key clauses - handle both formats
+            # Extract and parse key clauses
             key_clauses = []
             try:
-                key_clauses_match = re.search(r"##KEY CLAUSES\s*\n(.*?)(?=\n##RISK ASSESSMENT|$)", analysis_text, re.DOTALL)
-                if not key_clauses_match:
-                    # Try plain format
-                    key_clauses_match = re.search(r"KEY CLAUSES ANALYSIS\s*\n(.*?)(?=\nRISK ASSESSMENT|$)", analysis_text, re.DOTALL)
-
-                if key_clauses_match:
-                    clauses_section = key_clauses_match.group(1).strip()
+                clauses_section = sections.get("KEY CLAUSES")
+                if clauses_section is not None:
                     # Parse individual clauses (numbered 1-7)
                     # Look for patterns like "1. Clause Title" or "- **Clause Name**: *Payment Terms*"
-                    clause_pattern = r"(\d+)\.\s*(.*?)(?=\n\d+\.|$)"
-                    matches = re.findall(clause_pattern, clauses_section, re.DOTALL)
+                    matches = list(islice(_RE_CLAUSE_ITEM.finditer(clauses_section), MAX_KEY_CLAUSES))
 
                     # If no numbered clauses, try markdown format
                     if not matches:
-                        clause_pattern = r"-\s*\*\*Clause Name\*\*:\s*\*(.*?)\*\s*\n\s*(.*?)(?=-\s*\*\*Clause Name\*\*|$)"
-                        matches = re.findall(clause_pattern, clauses_section, re.DOTALL)
-
-                    for match in matches[:7]:  # Limit to 7 clauses
-                        if len(match) == 2:
-                            clause_num_or_name, clause_content = match
-                            if clause_num_or_name.isdigit():
-                                clause_data = {"clause_number": int(clause_num_or_name)}
-                                # Parse sub-components within each clause
-                                sub_patterns = {
-                                    "reference": r"Exact Clause Reference:\s*(.*?)(?=\n[A-Z][a-zA-Z\s]+:|$)",
-                                    "explanation": r"Plain English Explanation:\s*(.*?)(?=\n[A-Z][a-zA-Z\s]+:|$)",
-                                    "implications": r"Legal Implications:\s*(.*?)(?=\n[A-Z][a-zA-Z\s]+:|$)",
-                                    "impact": r"Business Impact:\s*(.*?)(?=\n[A-Z][a-zA-Z\s]+:|$)",
-                                    "concerns": r"Potential Concerns:\s*(.*?)(?=\n\d+\.|$)"
-                                }
-                            else:
-                                # Markdown format
-                                clause_data = {"clause_number": len(key_clauses) + 1, "reference": clause_num_or_name}
-                                # Parse sub-components for markdown format
-                                sub_patterns = {
-                                    "explanation": r"-\s*\*\*What it means\*\*:\s*(.*?)(?=\n\s*-\s*\*\*[A-Z]|$)",
-                                    "implications": r"-\s*\*\*Obligations/Rights\*\*:\s*(.*?)(?=\n\s*-\s*\*\*[A-Z]|$)",
-                                    "impact": r"-\s*\*\*Importance\*\*:\s*(.*?)(?=\n\s*-\s*\*\*[A-Z]|$)",
-                                    "concerns": r"-\s*\*\*Importance\*\*:\s*(.*?)(?=\n\s*-\s*\*\*[A-Z]|$)"
-                                }
-
-                            # For plain format, use more specific patterns with indentation handling
-                            sub_patterns = {
-                                "reference": r"Exact Clause Reference:\s*(.*?)(?=\n\s*Plain English Explanation:|$)",
-                                "explanation": r"Plain English Explanation:\s*(.*?)(?=\n\s*Legal Implications:|$)",
-                                "implications": r"Legal Implications:\s*(.*?)(?=\n\s*Business Impact:|$)",
-                                "impact": r"Business Impact:\s*(.*?)(?=\n\s*Potential Concerns:|$)",
-                                "concerns": r"Potential Concerns:\s*(.*?)(?=\n\d+\.|$)"
-                            }
+                        matches = list(islice(_RE_CLAUSE_ITEM_MD.finditer(clauses_section), MAX_KEY_CLAUSES))
 
-                            for field, pattern in sub_patterns.items():
-                                field_match = re.search(pattern, clause_content, re.DOTALL)
-                                if field_match:
-                                    clause_data[field] = field_match.group(1).strip()
-                                else:
-                                    clause_data[field] = ""
+                    for match in matches:
+                        clause_num_or_name, clause_content = match.groups()
+                        if clause_num_or_name.isdigit():
+                            clause_data = {"clause_number": int(clause_num_or_name)}
+                        else:
+                            # Markdown format
+                            clause_data = {"clause_number": len(key_clauses) + 1}
+
+                        for field, pattern in _CLAUSE_FIELD_PATTERNS.items():
+                            field_match = pattern.search(clause_content)
+                            if field_match:
+                                clause_data[field] = field_match.group(1).strip()
+                            else:
+                                clause_data[field] = ""
 
-                            key_clauses.append(clause_data)
+                        key_clauses.append(clause_data)
                 else:
                     logging.warning("KEY CLAUSES section not found in analysis text")
             except Exception as e:
                 logging.error(f"Error parsing key clauses section with regex: {str(e)}")
                 key_clauses = []
 
-            risk_assessment = ""
-            try:
-     
-                risk_match = re.search(r"##RISK ASSESSMENT\s*\n(.*?)(?=\n##|$)", analysis_text, re.DOTALL)
-                if not risk_match:
-                    # Try plain format - capture until end of response since no other sections follow
-                    risk_match = re.search(r"RISK ASSESSMENT\s*\n(.*?)$", analysis_text, re.DOTALL)
-                if risk_match:
-                    risk_assessment = risk_match.group(1).strip()
-                    # Clean up any extra whitespace and formatting
-                    risk_assessment = re.sub(r'\n\s*\n\s*\n', '\n\n', risk_assessment)
-                else:
-                    logging.warning("RISK ASSESSMENT section not found in analysis text")
-            except Exception as e:
-                logging.error(f"Error parsing risk assessment section with regex: {str(e)}")
-                risk_assessment = ""
-
-
+            # Risk assessment runs until the next heading, usually the end of the response
+            risk_assessment = sections.get("RISK ASSESSMENT", "")
+            if "RISK ASSESSMENT" in sections:
+                # Clean up any extra whitespace and formatting
+                risk_assessment = _RE_BLANK_LINES.sub('\n\n', risk_assessment)
+            else:
+                logging.warning("RISK ASSESSMENT section not found in analysis text")
 
         except Exception as e:
             logging.error(f"Error during AI analysis: {str(e)}", exc_info=True)
-            await db.documents.update_one(
+            await unacked_documents.update_one(
                 {"id": document_id},
                 {"$set": {"analysis_status": "failed"}}
             )
             raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
         # Update document with analysis
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        sync_db.documents.update_one(
+        await document_writer.submit(UpdateOne(
             {"id": document_id},
             {"$set": {
                 "analysis_status": "completed",
+                "analysis_model": GEMINI_MODEL,
                 "summary": summary,
                 "key_clauses": key_clauses,
-                "risk_assessment": risk_assessment.strip()
+                "risk_assessment": risk_assessment.strip(),
+                **extraction_info
             }}
-        )
+        ))
         return {
             "document_id": document_id,
             "status": "completed",
@@ -664,52 +997,38 @@ FORMATTING REQUIREMENTS:
     except Exception as e:
         logging.error(f"Analysis error: {e}")
         # Update status to failed
-        await db.documents.update_one(
+        await unacked_documents.update_one(
             {"id": document_id},
             {"$set": {"analysis_status": "failed"}}
         )
         raise HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
 
-# Ask questions about document
-@api_router.post("/documents/ask")
-async def ask_question(request: QuestionRequest):
-    """Ask a specific question about a document"""
-    try:
-        # Get document from database
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        document = sync_db.documents.find_one({"id": request.document_id})
-        if not document:
-            sync_client.close()
-            raise HTTPException(status_code=404, detail="Document not found")
-        sync_client.close()
-        
-        session_id = request.session_id or f"qa_{request.document_id}_{uuid.uuid4()}"
-
-        # Create file content for analysis
-        file_content = FileContentWithMimeType(
-            file_path=document['file_path'],
-            mime_type=document['file_type']
-        )
-        
-        # Read the document content for the question
+async def _build_question_prompt(request: QuestionRequest, document: dict) -> str:
+    """Load the document text and build the prompt for a question about it"""
+    # Read the document content for the question, reusing the text cached by an earlier question
+    file_sha = document.get('content_hash')
+    if not file_sha:
+        try:
+            file_sha = await asyncio.to_thread(_file_sha256, document['file_path'])
+        except OSError:
+            file_sha = None
+
+    if file_sha and document.get('extracted_text') is not None and document.get('extracted_sha') == file_sha:
+        document_text = _unpack_extracted_text(document['extracted_text'])
+        logging.info(f"Using cached document text for question. Length: {len(document_text)} characters")
+    else:
+        extraction_ok = False
         try:
             if document['file_type'] == 'application/pdf' or document['file_path'].lower().endswith('.pdf'):
-                # Extract text from PDF using PyPDF2
+                # Extract text from PDF off the event loop, with OCR running alongside
                 try:
-                    reader = PdfReader(document['file_path'])
-                    text_pages = []
-                    for page in reader.pages:
-                        page_text = page.extract_text()
-                        if page_text and page_text.strip():
-                            text_pages.append(page_text)
+                    document_text, ocr_text = await _extract_pdf_text_or_ocr(
+                        document['file_path'], QA_MAX_CHARS, document.get('extraction_mode')
+                    )
 
-                    document_text = "\n".join(text_pages)
-
-                    if len(document_text.strip()) < 50:
-                        # Try OCR as fallback for image-based PDFs
-                        logging.info("Attempting OCR processing for image-based PDF in question answering")
-                        ocr_text = extract_text_with_ocr(document['file_path'])
+                    if ocr_text is not None:
+                        # Fall back to OCR for image-based PDFs
+                        logging.info("Using OCR result for image-based PDF in question answering")
 
                         if len(ocr_text.strip()) > len(document_text.strip()):
                             document_text = ocr_text
@@ -719,39 +1038,51 @@ async def ask_question(request: QuestionRequest):
                             logging.warning(f"PDF text extraction and OCR yielded insufficient content for question: {len(document_text)} characters")
                     else:
                         logging.info(f"Extracted text from PDF for question. Length: {len(document_text)} characters")
+                    extraction_ok = True
 
                 except Exception as e:
                     document_text = f"Failed to extract text from PDF: {str(e)}. This PDF may be corrupted, password-protected, or in an unsupported format."
                     logging.error(f"PDF text extraction error for file {document['file_path']}: {str(e)}")
             else:
                 with open(document['file_path'], 'r', encoding='utf-8') as f:
-                    document_text = f.read()
+                    document_text = f.read(QA_MAX_CHARS)
                 logging.info(f"Document content read for question. Length: {len(document_text)} characters")
+                extraction_ok = True
         except UnicodeDecodeError:
             with open(document['file_path'], 'rb') as f:
                 document_bytes = f.read()
                 try:
                     document_text = document_bytes.decode('utf-8')
+                    extraction_ok = True
                 except UnicodeDecodeError:
                     document_text = "Unable to decode document content. This may be a binary file that requires specialized processing."
         except Exception as e:
             document_text = f"Error reading document: {str(e)}"
 
-        # Create question message with document content
-        if len(document_text.strip()) < 100:
-            # If document content is too short or empty
-            question_prompt = f"""I need to ask a question about a legal document, but the document content could not be properly extracted. This may be due to file format limitations.
+        if extraction_ok and file_sha:
+            await document_writer.submit(UpdateOne(
+                {"id": request.document_id},
+                {"$set": {
+                    "extracted_text": _pack_extracted_text(document_text),
+                    "extracted_sha": file_sha
+                }}
+            ))
+
+    # Create question message with document content
+    if len(document_text.strip()) < 100:
+        # If document content is too short or empty
+        question_prompt = f"""I need to ask a question about a legal document, but the document content could not be properly extracted. This may be due to file format limitations.
 
 Document type: {document['file_type']}
 Question: {request.question}
 
 Since I cannot access the specific document content, please provide general guidance about this type of question for {document['file_type']} documents. Explain what factors would typically be considered when answering this question for this document type."""
-        else:
-            # If we have meaningful document content
-            question_prompt = f"""You are a legal document analysis expert. Below is the content of a legal document. Please answer the specific question based ONLY on this document's content.
+    else:
+        # If we have meaningful document content
+        question_prompt = f"""You are a legal document analysis expert. Below is the content of a legal document. Please answer the specific question based ONLY on this document's content.
 
 DOCUMENT CONTENT:
-{document_text[:100000]}
+{document_text[:QA_MAX_CHARS]}
 
 QUESTION: {request.question}
 
@@ -765,11 +1096,40 @@ Please provide:
 
 Keep your answer accessible to someone without legal training, but make sure it's accurate to this document's actual content."""
 
-        question_message = UserMessage(text=question_prompt)
+    question_message = UserMessage(text=question_prompt)
+
+    return question_prompt
+
+# Ask questions about document
+@api_router.post("/documents/ask")
+async def ask_question(request: QuestionRequest):
+    """Ask a specific question about a document"""
+    try:
+        # Get document from database
+        document = await db.documents.find_one({"id": request.document_id}, QA_PROJECTION)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        session_id = request.session_id or f"qa_{request.document_id}_{uuid.uuid4()}"
+
+        # Create file content for analysis
+        file_content = FileContentWithMimeType(
+            file_path=document['file_path'],
+            mime_type=document['file_type']
+        )
         
-        answer = await send_message(question_prompt)
-        if not answer or len(answer.strip()) < 10:
-            raise Exception("Empty or invalid response from AI service")
+        # Repeated questions about the same document reuse the earlier answer,
+        # skipping text extraction and prompt construction
+        cache_key = hashlib.sha1(f"{request.document_id}:{request.question.strip().lower()}".encode()).hexdigest()
+        answer = QA_ANSWER_CACHE.get(cache_key)
+        if answer is None:
+            question_prompt = await _build_question_prompt(request, document)
+            answer = await send_message(question_prompt)
+            if not answer or len(answer.strip()) < 10:
+                raise Exception("Empty or invalid response from AI service")
+            QA_ANSWER_CACHE[cache_key] = answer
+        else:
+            logging.info(f"Using cached answer for question on document {request.document_id}")
         
         # Save chat message
         chat_message = ChatMessage(
@@ -779,14 +1139,7 @@ Keep your answer accessible to someone without legal training, but make sure it'
             answer=answer
         )
 
-        chat_dict = chat_message.model_dump()
-        chat_dict['timestamp'] = chat_dict['timestamp'].isoformat()
-
-        # Use synchronous MongoDB client to avoid event loop conflicts
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        sync_db.chat_messages.insert_one(chat_dict)
-        sync_client.close()
+        await chat_writer.submit(InsertOne(chat_message.model_dump()))
         
         return {
             "question": request.question,
@@ -807,150 +1160,319 @@ async def get_chat_history(document_id: str, session_id: Optional[str] = None):
         if session_id:
             query["session_id"] = session_id
 
-        # Use synchronous MongoDB client to avoid event loop conflicts
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        messages = list(sync_db.chat_messages.find(query).sort("timestamp", 1))
-        sync_client.close()
+        messages = await db.chat_messages.find(query, CHAT_MESSAGE_PROJECTION).sort("timestamp", 1).to_list(length=None)
 
-        for msg in messages:
-            if isinstance(msg.get('timestamp'), str):
-                msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
-
-        return [ChatMessage(**msg) for msg in messages]
+        # Stored messages were validated on insert, so skip re-validation
+        return [ChatMessage.model_construct(**msg) for msg in messages]
 
     except Exception as e:
         logging.error(f"Get chat history error: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve chat history")
 
+# Keywords used to colour-code report text by risk level
+_RE_HIGH_RISK = re.compile(r'HIGH-RISK|CRITICAL|SEVERE')
+_RE_MEDIUM_RISK = re.compile(r'MEDIUM-RISK|MODERATE')
+_RE_LOW_RISK = re.compile(r'LOW-RISK|MINIMAL')
+
+# RGB colours for risk levels in Word exports
+RISK_COLORS = {
+    'high': (255, 0, 0),  # Red
+    'medium': (255, 165, 0),  # Orange
+    'low': (0, 128, 0)  # Green
+}
+
+# Non-empty lines of a report section
+_RE_REPORT_LINE = re.compile(r'[^\n]+')
+
+def _iter_report_lines(text: str):
+    """Yield the stripped, non-blank lines of a report section without splitting it into a list"""
+    for match in _RE_REPORT_LINE.finditer(text):
+        line = match.group().strip()
+        if line:
+            yield line
+
+def _risk_level(text: str) -> Optional[str]:
+    """Classify text as 'high', 'medium' or 'low' risk by keyword, or None"""
+    upper = text.upper()
+    if _RE_HIGH_RISK.search(upper):
+        return 'high'
+    if _RE_MEDIUM_RISK.search(upper):
+        return 'medium'
+    if _RE_LOW_RISK.search(upper):
+        return 'low'
+    return None
+
+def _iter_risk_spans(text: str):
+    """Yield (risk level, markup) for each run of consecutive lines sharing a risk level
+
+    Lines in a run are joined with <br/> so each run renders as a single Paragraph.
+    """
+    for level, lines in groupby(_iter_report_lines(text), key=_risk_level):
+        yield level, "<br/>".join(lines)
+
+@lru_cache(maxsize=None)
+def _pdf_report_styles():
+    """Build the PDF report styles once and share them across exports"""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.colors import red, orange, green
+
+    styles = getSampleStyleSheet()
+
+    # Create custom styles for risk levels
+    high_risk_style = ParagraphStyle(
+        'HighRisk',
+        parent=styles['Normal'],
+        textColor=red,
+        fontSize=12,
+        spaceAfter=12
+    )
+    medium_risk_style = ParagraphStyle(
+        'MediumRisk',
+        parent=styles['Normal'],
+        textColor=orange,
+        fontSize=12,
+        spaceAfter=12
+    )
+    low_risk_style = ParagraphStyle(
+        'LowRisk',
+        parent=styles['Normal'],
+        textColor=green,
+        fontSize=12,
+        spaceAfter=12
+    )
+
+    risk_styles = {
+        'high': high_risk_style,
+        'medium': medium_risk_style,
+        'low': low_risk_style,
+        None: styles['Normal']
+    }
+
+    return styles, risk_styles
+
+def _build_pdf_report(document: dict, sections: dict, summary: str, risk_assessment: str,
+                       recommendations: str, plain_english_explanation: str, qa_messages: list):
+    """Render the analysis report as a PDF (blocking, run in a worker thread)"""
+    # For PDF, create a formatted document with color coding for risk levels
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from io import BytesIO
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles, risk_styles = _pdf_report_styles()
+
+    story = []
+
+    # Title
+    story.append(Paragraph("LEGAL DOCUMENT ANALYSIS REPORT", styles['Title']))
+    story.append(Spacer(1, 24))
+
+    # Document Information
+    story.append(Paragraph("DOCUMENT INFORMATION", styles['Heading2']))
+    story.append(Paragraph(f"Document Name: {document['filename']}", styles['Normal']))
+    story.append(Paragraph(f"Analysis Date: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}", styles['Normal']))
+    story.append(Paragraph(f"Document ID: {document['id']}", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Add sections
+    if sections.get('summary', True):
+        story.append(Paragraph("EXECUTIVE SUMMARY", styles['Heading2']))
+
+        # Color-code important terms in summary
+        for level, span in _iter_risk_spans(summary):
+            story.append(Paragraph(span, risk_styles[level]))
+
+        story.append(Spacer(1, 12))
+
+    if sections.get('clauses', True):
+        story.append(Paragraph("KEY CLAUSES ANALYSIS", styles['Heading2']))
+        key_clauses = document.get('key_clauses', [])
+        for i, clause in enumerate(key_clauses, 1):
+            story.append(Paragraph(f"{i}. {clause.get('reference', 'N/A')}", styles['Heading3']))
+
+            # Color-code clause explanations based on risk keywords
+            explanation = clause.get('explanation', 'N/A')
+            story.append(Paragraph(f"Explanation: {explanation}", risk_styles[_risk_level(explanation)]))
+
+            story.append(Paragraph(f"Legal Implications: {clause.get('implications', 'N/A')}", styles['Normal']))
+            story.append(Paragraph(f"Business Impact: {clause.get('impact', 'N/A')}", styles['Normal']))
+
+            # Color-code potential concerns
+            concerns = clause.get('concerns', 'N/A')
+            story.append(Paragraph(f"Potential Concerns: {concerns}", risk_styles[_risk_level(concerns)]))
+
+            story.append(Spacer(1, 6))
+
+    if sections.get('risks', True):
+        story.append(Paragraph("RISK ASSESSMENT", styles['Heading2']))
+
+        # Group consecutive lines of the same risk level into one paragraph
+        for level, span in _iter_risk_spans(risk_assessment):
+            story.append(Paragraph(span, risk_styles[level]))
+
+        story.append(Spacer(1, 12))
+
+    if sections.get('recommendations', True):
+        story.append(Paragraph("RECOMMENDATIONS", styles['Heading2']))
+
+        # Color-code recommendations based on risk keywords
+        for level, span in _iter_risk_spans(recommendations):
+            story.append(Paragraph(span, risk_styles[level]))
+
+        story.append(Spacer(1, 12))
+
+    if sections.get('plain_english', True):
+        story.append(Paragraph("PLAIN ENGLISH EXPLANATION", styles['Heading2']))
+
+        # Plain english explanation typically doesn't need color coding
+        plain_english_markup = "<br/>".join(_iter_report_lines(plain_english_explanation))
+        if plain_english_markup:
+            story.append(Paragraph(plain_english_markup, styles['Normal']))
+
+        story.append(Spacer(1, 12))
+
+    if sections.get('qa', True):
+        if qa_messages:
+            story.append(Paragraph("Q&A HISTORY", styles['Heading2']))
+            for msg in qa_messages:
+                story.append(Paragraph(f"Question: {msg.get('question', 'N/A')}", styles['Normal']))
+                story.append(Paragraph(f"Answer: {msg.get('answer', 'N/A')}", styles['Normal']))
+                story.append(Spacer(1, 6))
+
+    doc.build(story)
+    return buffer
+
+def _build_docx_report(document: dict, sections: dict, summary: str, risk_assessment: str,
+                        recommendations: str, plain_english_explanation: str, qa_messages: list):
+    """Render the analysis report as a Word document (blocking, run in a worker thread)"""
+    # For Word document, create a formatted DOCX with color coding
+    from docx import Document
+    from docx.shared import RGBColor
+    from io import BytesIO
+
+    doc = Document()
+    doc.add_heading('Legal Document Analysis Report', 0)
+
+    # Add document info
+    doc.add_heading('Document Information', level=1)
+    doc.add_paragraph(f"Document Name: {document['filename']}")
+    doc.add_paragraph(f"Analysis Date: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
+    doc.add_paragraph(f"Document ID: {document['id']}")
+
+    # Add sections
+    if sections.get('summary', True):
+        doc.add_heading('Executive Summary', level=1)
+
+        # Color-code important terms in summary
+        for line in _iter_report_lines(summary):
+            p = doc.add_paragraph()
+
+            # Check for risk level keywords in summary
+            run = p.add_run(line)
+            risk_color = RISK_COLORS.get(_risk_level(line))
+            if risk_color:
+                run.font.color.rgb = RGBColor(*risk_color)
+
+    if sections.get('clauses', True):
+        doc.add_heading('Key Clauses Analysis', level=1)
+        key_clauses = document.get('key_clauses', [])
+        for i, clause in enumerate(key_clauses, 1):
+            doc.add_heading(f'{i}. {clause.get("reference", "N/A")}', level=2)
+
+            # Color-code clause explanations
+            explanation = clause.get('explanation', 'N/A')
+            p_exp = doc.add_paragraph()
+            p_exp.add_run("Explanation: ")
+            run = p_exp.add_run(explanation)
+            risk_color = RISK_COLORS.get(_risk_level(explanation))
+            if risk_color:
+                run.font.color.rgb = RGBColor(*risk_color)
+
+            doc.add_paragraph(f"Legal Implications: {clause.get('implications', 'N/A')}")
+            doc.add_paragraph(f"Business Impact: {clause.get('impact', 'N/A')}")
+
+            # Color-code potential concerns
+            concerns = clause.get('concerns', 'N/A')
+            p_conc = doc.add_paragraph()
+            p_conc.add_run("Potential Concerns: ")
+            run = p_conc.add_run(concerns)
+            risk_color = RISK_COLORS.get(_risk_level(concerns))
+            if risk_color:
+                run.font.color.rgb = RGBColor(*risk_color)
+
+    if sections.get('risks', True):
+        doc.add_heading('Risk Assessment', level=1)
+
+        # Parse and color-code risk sections line by line
+        for line in _iter_report_lines(risk_assessment):
+            p = doc.add_paragraph()
+
+            # Determine color based on risk level keywords
+            run = p.add_run(line)
+            risk_color = RISK_COLORS.get(_risk_level(line))
+            if risk_color:
+                run.font.color.rgb = RGBColor(*risk_color)
+
+    if sections.get('recommendations', True):
+        doc.add_heading('Recommendations', level=1)
+
+        # Color-code recommendations based on risk keywords
+        for line in _iter_report_lines(recommendations):
+            p = doc.add_paragraph()
+
+            run = p.add_run(line)
+            risk_color = RISK_COLORS.get(_risk_level(line))
+            if risk_color:
+                run.font.color.rgb = RGBColor(*risk_color)
+
+    if sections.get('plain_english', True):
+        doc.add_heading('Plain English Explanation', level=1)
+
+        # Plain english explanation typically doesn't need color coding
+        for line in _iter_report_lines(plain_english_explanation):
+            doc.add_paragraph(line)
+
+    if sections.get('qa', True):
+        doc.add_heading('Q&A History', level=1)
+        for msg in qa_messages:
+            doc.add_paragraph(f"Question: {msg.get('question', 'N/A')}")
+            doc.add_paragraph(f"Answer: {msg.get('answer', 'N/A')}")
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer
+
+async def _iter_buffer(buffer, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Stream an in-memory export in chunks, closing the buffer once sent"""
+    try:
+        while chunk := buffer.read(chunk_size):
+            yield chunk
+    finally:
+        buffer.close()
+
 # Export report endpoint
 @api_router.post("/documents/{document_id}/export")
 async def export_document(document_id: str, export_data: dict):
     """Export document analysis as PDF or Word document"""
     try:
         # Get document from database
-        sync_client = pymongo.MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
-        sync_db = sync_client[os.environ.get('DB_NAME', 'legal_docs')]
-        document = sync_db.documents.find_one({"id": document_id})
+        document = await db.documents.find_one({"id": document_id}, EXPORT_PROJECTION)
         if not document:
-            sync_client.close()
             raise HTTPException(status_code=404, detail="Document not found")
 
         # Check if analysis is completed
         if document.get('analysis_status') != 'completed':
-            sync_client.close()
             raise HTTPException(status_code=400, detail="Document analysis not completed")
 
         # Get export parameters
         format_type = export_data.get('format', 'pdf')
         sections = export_data.get('sections', {})
 
-        # Prepare export content
-        export_content = f"""LEGAL DOCUMENT ANALYSIS REPORT
-
-DOCUMENT INFORMATION
-===================
-Document Name: {document['filename']}
-Analysis Date: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}
-Document ID: {document_id}
-
-"""
-
-        # Add sections based on user selection
-        if sections.get('summary', True):
-            export_content += f"""
-EXECUTIVE SUMMARY
-=================
-{document.get('summary', 'No summary available')}
-
-"""
-
-        if sections.get('clauses', True):
-            export_content += f"""
-KEY CLAUSES ANALYSIS
-====================
-"""
-            key_clauses = document.get('key_clauses', [])
-            for i, clause in enumerate(key_clauses, 1):
-                export_content += f"""
-{i}. {clause.get('reference', 'N/A')}
-   Explanation: {clause.get('explanation', 'N/A')}
-   Legal Implications: {clause.get('implications', 'N/A')}
-   Business Impact: {clause.get('impact', 'N/A')}
-   Potential Concerns: {clause.get('concerns', 'N/A')}
-
-"""
-
-        if sections.get('risks', True):
-            export_content += f"""
-RISK ASSESSMENT
-===============
-{document.get('risk_assessment', 'No risk assessment available')}
-
-"""
-
-        if sections.get('recommendations', True):
-            export_content += f"""
-RECOMMENDATIONS
-===============
-{document.get('recommendations', 'No recommendations available')}
-
-"""
-
-        if sections.get('plain_english', True):
-            export_content += f"""
-PLAIN ENGLISH EXPLANATION
-=========================
-{document.get('plain_english_explanation', 'No plain english explanation available')}
-
-"""
-
+        qa_messages = []
         if sections.get('qa', True):
             # Get Q&A history
-            qa_messages = list(sync_db.chat_messages.find({"document_id": document_id}).sort("timestamp", 1))
-            if qa_messages:
-                export_content += f"""
-Q&A HISTORY
-===========
-"""
-                for msg in qa_messages:
-                    export_content += f"""
-Question: {msg.get('question', 'N/A')}
-Answer: {msg.get('answer', 'N/A')}
-Timestamp: {msg.get('timestamp', 'N/A')}
-
-"""
-
-        # Clean the AI response content to remove artifacts
-        def clean_ai_response(text):
-            if text is None:
-                return ''
-            if not text:
-                return ''
-            # Remove various AI artifacts and formatting
-            text = text.replace('**', '')
-            text = text.replace('*', '')
-            text = text.replace('```', '')
-            text = text.replace('`', '')
-            text = text.replace('###', '')
-            text = text.replace('##', '')
-            text = text.replace('#', '')
-            text = text.replace('•', '')
-            text = text.replace('·', '')
-            text = text.replace('▪', '')
-            text = text.replace('◦', '')
-            # Remove markdown-style bold and italic
-            text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-            text = re.sub(r'\*(.*?)\*', r'\1', text)
-            text = re.sub(r'_(.*?)_', r'\1', text)
-            text = re.sub(r'__(.*?)__', r'\1', text)
-            # Remove headers
-            text = re.sub(r'^#+\s*', '', text, flags=re.MULTILINE)
-            # Clean up excessive whitespace
-            text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)  # Multiple newlines to double
-            text = re.sub(r'\s+', ' ', text)  # Multiple spaces to single
-            text = text.strip()
-            return text
+            qa_messages = await db.chat_messages.find({"document_id": document_id}, {"_id": 0, "question": 1, "answer": 1}).sort("timestamp", 1).to_list(length=None)
 
         # Apply cleaning to all sections
         summary = clean_ai_response(document.get('summary', '')) or ''
@@ -968,343 +1490,36 @@ Timestamp: {msg.get('timestamp', 'N/A')}
         # Generate file content based on format
         if format_type == 'pdf':
             # For PDF, create a formatted document with color coding for risk levels
-            from reportlab.lib.pagesizes import letter
-            from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-            from reportlab.lib.colors import red, orange, green
-            from io import BytesIO
-
-            buffer = BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            styles = getSampleStyleSheet()
-
-            # Create custom styles for risk levels
-            high_risk_style = ParagraphStyle(
-                'HighRisk',
-                parent=styles['Normal'],
-                textColor=red,
-                fontSize=12,
-                spaceAfter=12
-            )
-            medium_risk_style = ParagraphStyle(
-                'MediumRisk',
-                parent=styles['Normal'],
-                textColor=orange,
-                fontSize=12,
-                spaceAfter=12
+            buffer = await asyncio.get_running_loop().run_in_executor(
+                None, _build_pdf_report, document, sections, summary, risk_assessment,
+                recommendations, plain_english_explanation, qa_messages
             )
-            low_risk_style = ParagraphStyle(
-                'LowRisk',
-                parent=styles['Normal'],
-                textColor=green,
-                fontSize=12,
-                spaceAfter=12
-            )
-
-            story = []
-
-            # Title
-            story.append(Paragraph("LEGAL DOCUMENT ANALYSIS REPORT", styles['Title']))
-            story.append(Spacer(1, 24))
-
-            # Document Information
-            story.append(Paragraph("DOCUMENT INFORMATION", styles['Heading2']))
-            story.append(Paragraph(f"Document Name: {document['filename']}", styles['Normal']))
-            story.append(Paragraph(f"Analysis Date: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}", styles['Normal']))
-            story.append(Paragraph(f"Document ID: {document_id}", styles['Normal']))
-            story.append(Spacer(1, 12))
-
-            # Add sections
-            if sections.get('summary', True):
-                story.append(Paragraph("EXECUTIVE SUMMARY", styles['Heading2']))
-
-                # Color-code important terms in summary
-                summary_lines = summary.split('\n')
-                for line in summary_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # Check for risk level keywords in summary
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        story.append(Paragraph(line, high_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        story.append(Paragraph(line, medium_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        story.append(Paragraph(line, low_risk_style))
-                    else:
-                        story.append(Paragraph(line, styles['Normal']))
-
-                story.append(Spacer(1, 12))
-
-            if sections.get('clauses', True):
-                story.append(Paragraph("KEY CLAUSES ANALYSIS", styles['Heading2']))
-                key_clauses = document.get('key_clauses', [])
-                for i, clause in enumerate(key_clauses, 1):
-                    story.append(Paragraph(f"{i}. {clause.get('reference', 'N/A')}", styles['Heading3']))
-
-                    # Color-code clause explanations based on risk keywords
-                    explanation = clause.get('explanation', 'N/A')
-                    if any(keyword in explanation.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        story.append(Paragraph(f"Explanation: {explanation}", high_risk_style))
-                    elif any(keyword in explanation.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        story.append(Paragraph(f"Explanation: {explanation}", medium_risk_style))
-                    elif any(keyword in explanation.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        story.append(Paragraph(f"Explanation: {explanation}", low_risk_style))
-                    else:
-                        story.append(Paragraph(f"Explanation: {explanation}", styles['Normal']))
-
-                    story.append(Paragraph(f"Legal Implications: {clause.get('implications', 'N/A')}", styles['Normal']))
-                    story.append(Paragraph(f"Business Impact: {clause.get('impact', 'N/A')}", styles['Normal']))
-
-                    # Color-code potential concerns
-                    concerns = clause.get('concerns', 'N/A')
-                    if any(keyword in concerns.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        story.append(Paragraph(f"Potential Concerns: {concerns}", high_risk_style))
-                    elif any(keyword in concerns.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        story.append(Paragraph(f"Potential Concerns: {concerns}", medium_risk_style))
-                    elif any(keyword in concerns.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        story.append(Paragraph(f"Potential Concerns: {concerns}", low_risk_style))
-                    else:
-                        story.append(Paragraph(f"Potential Concerns: {concerns}", styles['Normal']))
-
-                    story.append(Spacer(1, 6))
-
-            if sections.get('risks', True):
-                story.append(Paragraph("RISK ASSESSMENT", styles['Heading2']))
-
-                # Parse and color-code risk sections
-                risk_lines = risk_assessment.split('\n')
+            buffer.seek(0)
 
-                for line in risk_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # Determine color based on risk level keywords
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        story.append(Paragraph(line, high_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        story.append(Paragraph(line, medium_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        story.append(Paragraph(line, low_risk_style))
-                    else:
-                        story.append(Paragraph(line, styles['Normal']))
-
-                story.append(Spacer(1, 12))
-
-            if sections.get('recommendations', True):
-                story.append(Paragraph("RECOMMENDATIONS", styles['Heading2']))
-
-                # Color-code recommendations based on risk keywords
-                recommendations_lines = recommendations.split('\n')
-                for line in recommendations_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        story.append(Paragraph(line, high_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        story.append(Paragraph(line, medium_risk_style))
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        story.append(Paragraph(line, low_risk_style))
-                    else:
-                        story.append(Paragraph(line, styles['Normal']))
-
-                story.append(Spacer(1, 12))
-
-            if sections.get('plain_english', True):
-                story.append(Paragraph("PLAIN ENGLISH EXPLANATION", styles['Heading2']))
-
-                # Plain english explanation typically doesn't need color coding
-                plain_english_lines = plain_english_explanation.split('\n')
-                for line in plain_english_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    story.append(Paragraph(line, styles['Normal']))
-
-                story.append(Spacer(1, 12))
-
-            if sections.get('qa', True):
-                qa_messages = list(sync_db.chat_messages.find({"document_id": document_id}).sort("timestamp", 1))
-                if qa_messages:
-                    story.append(Paragraph("Q&A HISTORY", styles['Heading2']))
-                    for msg in qa_messages:
-                        story.append(Paragraph(f"Question: {msg.get('question', 'N/A')}", styles['Normal']))
-                        story.append(Paragraph(f"Answer: {msg.get('answer', 'N/A')}", styles['Normal']))
-                        story.append(Spacer(1, 6))
-
-            doc.build(story)
-            pdf_content = buffer.getvalue()
-            buffer.close()
-
-            return Response(
-                content=pdf_content,
+            return StreamingResponse(
+                _iter_buffer(buffer),
                 media_type='application/pdf',
-                headers={"Content-Disposition": f"attachment; filename={document['filename'].replace('.pdf', '')}_analysis.pdf"}
+                headers={
+                    "Content-Disposition": f"attachment; filename={document['filename'].replace('.pdf', '')}_analysis.pdf",
+                    "Content-Length": str(buffer.getbuffer().nbytes)
+                }
             )
 
         elif format_type == 'word':
             # For Word document, create a formatted DOCX with color coding
-            from docx import Document
-            from docx.shared import RGBColor
-            from io import BytesIO
-
-            doc = Document()
-            doc.add_heading('Legal Document Analysis Report', 0)
-
-            # Add document info
-            doc.add_heading('Document Information', level=1)
-            doc.add_paragraph(f"Document Name: {document['filename']}")
-            doc.add_paragraph(f"Analysis Date: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
-            doc.add_paragraph(f"Document ID: {document_id}")
-
-            # Add sections
-            if sections.get('summary', True):
-                doc.add_heading('Executive Summary', level=1)
-
-                # Color-code important terms in summary
-                summary_lines = summary.split('\n')
-                for line in summary_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    p = doc.add_paragraph()
-
-                    # Check for risk level keywords in summary
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 0, 0)  # Red
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(0, 128, 0)  # Green
-                    else:
-                        p.add_run(line)
-
-            if sections.get('clauses', True):
-                doc.add_heading('Key Clauses Analysis', level=1)
-                key_clauses = document.get('key_clauses', [])
-                for i, clause in enumerate(key_clauses, 1):
-                    doc.add_heading(f'{i}. {clause.get("reference", "N/A")}', level=2)
-
-                    # Color-code clause explanations
-                    explanation = clause.get('explanation', 'N/A')
-                    p_exp = doc.add_paragraph()
-                    p_exp.add_run("Explanation: ")
-                    if any(keyword in explanation.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        run = p_exp.add_run(explanation)
-                        run.font.color.rgb = RGBColor(255, 0, 0)  # Red
-                    elif any(keyword in explanation.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        run = p_exp.add_run(explanation)
-                        run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
-                    elif any(keyword in explanation.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        run = p_exp.add_run(explanation)
-                        run.font.color.rgb = RGBColor(0, 128, 0)  # Green
-                    else:
-                        p_exp.add_run(explanation)
-
-                    doc.add_paragraph(f"Legal Implications: {clause.get('implications', 'N/A')}")
-                    doc.add_paragraph(f"Business Impact: {clause.get('impact', 'N/A')}")
-
-                    # Color-code potential concerns
-                    concerns = clause.get('concerns', 'N/A')
-                    p_conc = doc.add_paragraph()
-                    p_conc.add_run("Potential Concerns: ")
-                    if any(keyword in concerns.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        run = p_conc.add_run(concerns)
-                        run.font.color.rgb = RGBColor(255, 0, 0)  # Red
-                    elif any(keyword in concerns.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        run = p_conc.add_run(concerns)
-                        run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
-                    elif any(keyword in concerns.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        run = p_conc.add_run(concerns)
-                        run.font.color.rgb = RGBColor(0, 128, 0)  # Green
-                    else:
-                        p_conc.add_run(concerns)
-
-            if sections.get('risks', True):
-                doc.add_heading('Risk Assessment', level=1)
-
-                # Parse and color-code risk sections line by line
-                risk_lines = risk_assessment.split('\n')
-
-                for line in risk_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    p = doc.add_paragraph()
-
-                    # Determine color based on risk level keywords
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 0, 0)  # Red
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(0, 128, 0)  # Green
-                    else:
-                        p.add_run(line)
-
-            if sections.get('recommendations', True):
-                doc.add_heading('Recommendations', level=1)
-
-                # Color-code recommendations based on risk keywords
-                recommendations_lines = recommendations.split('\n')
-                for line in recommendations_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    p = doc.add_paragraph()
-
-                    if any(keyword in line.upper() for keyword in ['HIGH-RISK', 'CRITICAL', 'SEVERE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 0, 0)  # Red
-                    elif any(keyword in line.upper() for keyword in ['MEDIUM-RISK', 'MODERATE']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
-                    elif any(keyword in line.upper() for keyword in ['LOW-RISK', 'MINIMAL']):
-                        run = p.add_run(line)
-                        run.font.color.rgb = RGBColor(0, 128, 0)  # Green
-                    else:
-                        p.add_run(line)
-
-            if sections.get('plain_english', True):
-                doc.add_heading('Plain English Explanation', level=1)
-
-                # Plain english explanation typically doesn't need color coding
-                plain_english_lines = plain_english_explanation.split('\n')
-                for line in plain_english_lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    doc.add_paragraph(line)
-
-            if sections.get('qa', True):
-                doc.add_heading('Q&A History', level=1)
-                qa_messages = list(sync_db.chat_messages.find({"document_id": document_id}).sort("timestamp", 1))
-                for msg in qa_messages:
-                    doc.add_paragraph(f"Question: {msg.get('question', 'N/A')}")
-                    doc.add_paragraph(f"Answer: {msg.get('answer', 'N/A')}")
-
-            buffer = BytesIO()
-            doc.save(buffer)
-            docx_content = buffer.getvalue()
-            buffer.close()
-
-            return Response(
-                content=docx_content,
+            buffer = await asyncio.get_running_loop().run_in_executor(
+                None, _build_docx_report, document, sections, summary, risk_assessment,
+                recommendations, plain_english_explanation, qa_messages
+            )
+            buffer.seek(0)
+
+            return StreamingResponse(
+                _iter_buffer(buffer),
                 media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                headers={"Content-Disposition": f"attachment; filename={document['filename'].replace('.docx', '').replace('.pdf', '')}_analysis.docx"}
+                headers={
+                    "Content-Disposition": f"attachment; filename={document['filename'].replace('.docx', '').replace('.pdf', '')}_analysis.docx",
+                    "Content-Length": str(buffer.getbuffer().nbytes)
+                }
             )
 
         else:
@@ -1326,6 +1541,65 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_executor():
+    # Dedicated threads for PDF text extraction, so it can't starve the default executor
+    global extraction_executor, pdf_process_pool
+    extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extract")
+    if pdfium is None:
+        # Forking a process that already runs threads can deadlock the child, so start
+        # workers from a clean forkserver process (spawn where forkserver is unavailable)
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        pdf_process_pool = ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS, mp_context=multiprocessing.get_context(start_method)
+        )
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    if extraction_executor is not None:
+        extraction_executor.shutdown(cancel_futures=True)
+    if pdf_process_pool is not None:
+        pdf_process_pool.shutdown(cancel_futures=True)
+
+@app.on_event("startup")
+async def startup_token_encoding():
+    # Loading the tokenizer may download its BPE file, so don't hold up startup on it
+    _start_token_encoding_load()
+
+@app.on_event("startup")
+async def startup_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+@app.on_event("startup")
+async def startup_db_indexes():
+    # create_index is idempotent, so this is a no-op once the index exists
+    try:
+        await db.documents.create_index([("id", 1)], unique=True, name="id_unique")
+        await db.documents.create_index([("content_hash", 1), ("analysis_model", 1)])
+        await db.chat_messages.create_index([("document_id", 1), ("timestamp", 1)])
+    except Exception as e:
+        logging.error(f"Failed to create MongoDB indexes: {str(e)}")
+
+@app.on_event("startup")
+async def startup_write_batchers():
+    document_writer.start()
+    chat_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown_write_batchers():
+    await document_writer.stop()
+    await chat_writer.stop()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,41 @@
+import pytest
+
+from server import _split_analysis_sections
+
+SECTIONS = {
+    "EXECUTIVE SUMMARY": "The agreement covers consulting services.",
+    "KEY CLAUSES": "1. Payment Terms\nExact Clause Reference: Section 4",
+    "RISK ASSESSMENT": "HIGH-RISK: Unlimited liability.",
+}
+
+HEADING_FORMATS = {
+    "plain": "{name}",
+    "markdown": "## {name}",
+    "bold": "**{name}**",
+    "numbered": "{number}. {name}",
+    "markdown numbered": "## {number}. {name}",
+    "roman numbered": "{roman}. {name}",
+    "bold numbered": "**{number}. {name}:**",
+}
+
+ROMAN = ["I", "II", "III"]
+
+
+def build_response(heading_format):
+    parts = []
+    for i, (name, body) in enumerate(SECTIONS.items()):
+        heading_name = "KEY CLAUSES ANALYSIS" if name == "KEY CLAUSES" else name
+        heading = heading_format.format(name=heading_name, number=i + 1, roman=ROMAN[i])
+        parts.append(f"{heading}\n{body}\n")
+    return "\n".join(parts)
+
+
+@pytest.mark.parametrize("heading_format", HEADING_FORMATS.values(), ids=HEADING_FORMATS.keys())
+def test_split_analysis_sections(heading_format):
+    sections = _split_analysis_sections(build_response(heading_format))
+    assert sections == SECTIONS
+
+
+def test_split_analysis_sections_keeps_first_occurrence():
+    text = "EXECUTIVE SUMMARY\nFirst\n\nEXECUTIVE SUMMARY\nSecond\n"
+    assert _split_analysis_sections(text) == {"EXECUTIVE SUMMARY": "First"}
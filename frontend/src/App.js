@@ -203,6 +203,9 @@ const DocumentAnalysis = ({ document, onBack }) => {
         key_clauses: document.key_clauses || [],
         risk_assessment: document.risk_assessment || ''
       });
+    } else if (document.analysis_status === 'completed') {
+      // The document list only carries summary fields, so fetch the stored analysis
+      loadAnalysis();
     } else if (document.analysis_status === 'pending') {
       analyzeDocument();
     }
@@ -210,6 +213,19 @@ const DocumentAnalysis = ({ document, onBack }) => {
     loadChatHistory();
   }, [document]);
   
+  const loadAnalysis = async () => {
+    try {
+      const response = await axios.get(`${API}/documents/${document.id}`);
+      setAnalysis({
+        summary: response.data.summary || '',
+        key_clauses: response.data.key_clauses || [],
+        risk_assessment: response.data.risk_assessment || ''
+      });
+    } catch (error) {
+      console.error('Failed to load analysis:', error);
+    }
+  };
+  
   const analyzeDocument = async () => {
     setIsAnalyzing(true);
     try {
@@ -598,8 +614,15 @@ const DocumentsDashboard = ({
     setShowComparison(true);
   };
 
-  const handleExportClick = (doc) => {
-    setExportDocument(doc);
+  const handleExportClick = async (doc) => {
+    // The document list only carries summary fields, so fetch the full analysis
+    try {
+      const response = await axios.get(`${API}/documents/${doc.id}`);
+      setExportDocument(response.data);
+    } catch (error) {
+      console.error('Failed to load document for export:', error);
+      setExportDocument(doc);
+    }
     setShowExport(true);
   };
 